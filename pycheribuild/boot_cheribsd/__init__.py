@@ -56,7 +56,7 @@ from ..colour import AnsiColour, coloured
 from ..config.compilation_targets import CompilationTargets, CrossCompileTarget
 from ..processutils import commandline_to_str, keep_terminal_sane, run_and_kill_children_on_exit
 from ..qemu_utils import QemuOptions, riscv_bios_arguments
-from ..utils import ConfigBase, find_free_port, get_global_config, init_global_config
+from ..utils import ConfigBase, find_free_port, flush_log_messages, get_global_config, init_global_config
 
 _cheribuild_root = Path(__file__).parent.parent.parent
 _pexpect_dir = _cheribuild_root / "3rdparty/pexpect"
@@ -478,6 +478,7 @@ def success(*args, **kwargs):
 
 
 def print_cmd(cmd: "list[str]", **kwargs):
+    flush_log_messages()
     args_str = " ".join(shlex.quote(i) for i in list(cmd))
     if kwargs:
         print("\033[0;33mRunning ", args_str, " with ", kwargs.copy(), "\033[0m", sep="", file=sys.stderr, flush=True)
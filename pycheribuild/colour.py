@@ -28,6 +28,7 @@
 # SUCH DAMAGE.
 #
 from enum import Enum
+from typing import Optional
 
 
 class AnsiColour(Enum):
@@ -44,10 +45,22 @@ class AnsiColour(Enum):
         return "\x1b[1;" + str(self.value) + "m"
 
 
-def coloured(col: AnsiColour, *args, end="\x1b[0m", sep=" ") -> str:
+# The escape sequences are constant, so compute them once instead of on every coloured() call
+_COLOUR_PREFIX: "dict[AnsiColour, str]" = {c: c.escape_sequence() for c in AnsiColour}
+_RESET = "\x1b[0m"
+
+
+def coloured(col: AnsiColour, *args, end=_RESET, sep=" ", prefix: "Optional[str]" = None) -> str:
     if len(args) == 1:
-        if isinstance(args[0], (list, tuple)):
-            return col.escape_sequence() + sep.join(map(str, args[0])) + end
-        return col.escape_sequence() + str(args[0]) + end
+        # Note: A single list/tuple is only expanded if there is no prefix (the message helpers in utils.py used to
+        # pass the prefix as an additional argument, so this matches their previous output).
+        if isinstance(args[0], (list, tuple)) and prefix is None:
+            text = sep.join(map(str, args[0]))
+        else:
+            text = str(args[0])
     else:
-        return col.escape_sequence() + sep.join(map(str, args)) + end
+        text = sep.join(map(str, args))
+    if prefix is not None:
+        # Always separate the prefix from the message (even if sep is empty)
+        text = prefix + (sep or " ") + text if args else prefix
+    return _COLOUR_PREFIX[col] + text + end
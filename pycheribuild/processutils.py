@@ -50,7 +50,7 @@ from subprocess import CompletedProcess
 from typing import Callable, Optional, Union
 
 from .colour import AnsiColour, coloured
-from .utils import ConfigBase, OSInfo, Type_T, fatal_error, status_update, warning_message
+from .utils import ConfigBase, OSInfo, Type_T, fatal_error, flush_log_messages, status_update, warning_message
 
 __all__ = [
     "CompilerInfo",
@@ -265,6 +265,7 @@ def print_command(
     new_args = (shlex.quote(str(arg1)), *tuple(map(shlex.quote, map(str, remaining_args))))
     if output_file:
         new_args += (">", str(output_file))
+    flush_log_messages()
     # Avoid a space before the actual command if there is no prefic:
     if not prefix:
         print(coloured(colour, new_args, sep=sep), flush=True, **kwargs)
@@ -300,6 +301,7 @@ def _make_called_process_error(retcode, args, *, stdout=None, stderr=None, cwd=N
 
 
 def check_call_handle_noexec(cmdline: "list[str]", **kwargs):
+    flush_log_messages()
     try:
         with keep_terminal_sane(command=cmdline):
             return subprocess.check_call(cmdline, **kwargs)
@@ -318,6 +320,7 @@ def check_call_handle_noexec(cmdline: "list[str]", **kwargs):
 
 
 def popen_handle_noexec(cmdline: "list[str]", **kwargs) -> subprocess.Popen:
+    flush_log_messages()
     try:
         return subprocess.Popen(cmdline, **kwargs)
     except PermissionError as e:
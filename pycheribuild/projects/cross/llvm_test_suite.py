@@ -43,7 +43,7 @@ from .llvm import BuildCheriLLVM, BuildLLVMBase, BuildUpstreamLLVM
 from ..project import ReuseOtherProjectRepository
 from ..simple_project import BoolConfigOption
 from ...config.compilation_targets import FreeBSDTargetInfo
-from ...utils import classproperty, is_jenkins_build
+from ...utils import cached_classproperty, is_jenkins_build
 
 
 class BuildLLVMTestSuiteBase(BenchmarkMixin, CrossCompileCMakeProject):
@@ -60,7 +60,7 @@ class BuildLLVMTestSuiteBase(BenchmarkMixin, CrossCompileCMakeProject):
         return (cls.llvm_project.get_class_for_target(CompilationTargets.NATIVE_NON_PURECAP).target,)
 
     # noinspection PyMethodParameters
-    @classproperty
+    @cached_classproperty
     def llvm_project(self) -> "type[BuildLLVMBase]":
         target_info = self.get_crosscompile_target().target_info_cls
         if issubclass(target_info, FreeBSDTargetInfo):
@@ -30,6 +30,7 @@
 import contextlib
 import functools
 import os
+import shlex
 import shutil
 import socket
 import subprocess
@@ -55,6 +56,7 @@ __all__ = [
     "ThreadJoiner",
     "Type_T",
     "add_error_context",
+    "cached_classproperty",
     "classproperty",
     "coloured",
     "default_make_jobs_count",
@@ -62,6 +64,7 @@ __all__ = [
     "fatal_error",
     "final",
     "find_free_port",
+    "flush_log_messages",
     "get_global_config",
     "have_working_internet_connection",
     "include_local_file",
@@ -100,6 +103,25 @@ class classproperty(typing.Generic[Type_T]):  # noqa: N801
         return self.f(owner)
 
 
+# noinspection PyPep8Naming
+class cached_classproperty(classproperty[Type_T]):  # noqa: N801
+    # A classproperty that is only evaluated once per class (only use this for values that never change).
+    # The result is cached per owner instead of replacing the descriptor with a plain class attribute, since that
+    # would also return the cached value for subclasses (e.g. the per-target project classes created later).
+
+    def __init__(self, f: "Callable[[typing.Any], Type_T]") -> None:
+        super().__init__(f)
+        self._cache: "dict[type, Type_T]" = {}
+
+    def __get__(self, obj, owner) -> Type_T:
+        try:
+            return self._cache[owner]
+        except KeyError:
+            result = self.f(owner)
+            self._cache[owner] = result
+            return result
+
+
 # Placeholder until config has been initialized.
 if typing.TYPE_CHECKING:
     DoNotUseInIfStmt = bool
@@ -122,6 +144,8 @@ class ConfigBase:
         self.pretend = pretend
         self.force = force
         self.presume_connectivity = False
+        # Note: have_working_internet_connection() uses a process-wide cache, these fields are only kept up-to-date
+        # for compatibility with code that inspects them.
         self.internet_connection_last_checked_at: "Optional[float]" = None
         self.internet_connection_last_check_result = False
 
@@ -153,23 +177,31 @@ class SocketAndPort:
 
 
 def find_free_port(preferred_port: "Optional[int]" = None) -> SocketAndPort:
+    # Note: we intentionally don't set SO_REUSEADDR here. On Linux that would allow two placeholder sockets that
+    # are bound but not listening to share a port, so the returned socket would no longer reserve the port.
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     if preferred_port is not None:
         try:
             s.bind(("127.0.0.1", preferred_port))
-            return SocketAndPort(s, s.getsockname()[1])
+            return SocketAndPort(s, preferred_port)
         except OSError as e:
             import errno
 
             if e.errno != errno.EADDRINUSE:
                 warning_message("Got unexpected error when checking whether port", preferred_port, "is free:", e)
             status_update("Port", preferred_port, "is not available, falling back to using a random port")
-    s.bind(("localhost", 0))
-    return SocketAndPort(s, s.getsockname()[1])
+    # Use the numeric address instead of "localhost" to avoid a name lookup.
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    return SocketAndPort(s, port)
 
 
 def default_make_jobs_count() -> Optional[int]:
-    make_jobs = os.cpu_count()
+    try:
+        # Respect CPU affinity restrictions (e.g. when running in a container or a CI job limited to some CPUs)
+        make_jobs = len(os.sched_getaffinity(0))
+    except AttributeError:
+        make_jobs = os.cpu_count() or 1
     if make_jobs > 24:
         # don't use up all the resources on shared build systems
         # (you can still override this with the -j command line option)
@@ -177,61 +209,84 @@ def default_make_jobs_count() -> Optional[int]:
     return make_jobs
 
 
-def maybe_add_space(msg: str, sep: str) -> "tuple[str, ...]":
-    if not sep:
-        return msg, " "
-    return (msg,)
+def _write_message(text: str, stream: "typing.TextIO", *, flush: bool) -> None:
+    # Messages go through the normal buffering of sys.stdout/sys.stderr (so that they are ordered correctly relative
+    # to plain print() calls), but we only flush when needed instead of after every status message.
+    if stream is not sys.stdout:
+        # Ensure that buffered status messages appear before warnings/errors.
+        sys.stdout.flush()
+    stream.write(text)
+    if flush:
+        stream.flush()
+
+
+def flush_log_messages() -> None:
+    """Write out all buffered messages (must be called before running subprocesses that share stdout/stderr)"""
+    sys.stdout.flush()
+    sys.stderr.flush()
 
 
-def status_update(*args, sep=" ", **kwargs) -> None:
-    print(coloured(AnsiColour.cyan, *args, sep=sep), **kwargs)
+def _log(
+    colour: AnsiColour,
+    prefix: "Optional[str]",
+    sep: str,
+    args: "tuple[typing.Any, ...]",
+    stream: "typing.TextIO",
+    *,
+    end: str = "\n",
+    flush: bool = False,
+) -> None:
+    _write_message(coloured(colour, *args, sep=sep, prefix=prefix) + end, stream, flush=flush)
+
+
+def status_update(*args, sep=" ", end="\n", file: "Optional[typing.TextIO]" = None, flush=False) -> None:
+    _log(AnsiColour.cyan, None, sep, args, file or sys.stdout, end=end, flush=flush)
 
 
 def fixit_message(*args, sep=" ") -> None:
-    print(
-        coloured(AnsiColour.blue, maybe_add_space("Possible solution:", sep) + args, sep=sep),
-        file=sys.stderr,
-        flush=True,
-    )
+    _log(AnsiColour.blue, "Possible solution:", sep, args, sys.stderr, flush=True)
 
 
 def warning_message(*args, sep=" ", fixit_hint=None) -> None:
     # we ignore fatal errors when simulating a run
-    print(coloured(AnsiColour.magenta, maybe_add_space("Warning:", sep) + args, sep=sep), file=sys.stderr, flush=True)
+    _log(AnsiColour.magenta, "Warning:", sep, args, sys.stderr, flush=True)
     if fixit_hint:
         fixit_message(fixit_hint)
 
 
-_ERROR_CONTEXT: "list[str]" = []
+# The error context is per-thread so that messages from concurrently running threads use the right context.
+_tls = threading.local()
+
+
+def _ctx() -> "list[str]":
+    return _tls.__dict__.setdefault("stack", [])
 
 
 @contextlib.contextmanager
 def add_error_context(context: str):
-    _ERROR_CONTEXT.append(context)
+    error_context = _ctx()
+    error_context.append(context)
     try:
         yield
         # We don't pop the error context if there is an exception so that we can print the context in the
         # except clause of main()
-        _ERROR_CONTEXT.pop()
+        error_context.pop()
     except Exception as e:
         # print("Got exception in error context", context, e)
         raise e
 
 
-def _add_error_context(prefix, args, sep) -> "str":
-    if _ERROR_CONTEXT:
-        # _ERROR_CONTEXT might contain escape sequences so we have to reset to red afterwards
-        return coloured(
-            AnsiColour.red,
-            maybe_add_space(prefix + " " + _ERROR_CONTEXT[-1] + AnsiColour.red.escape_sequence() + ":", sep) + args,
-            sep=sep,
-        )
-    return coloured(AnsiColour.red, maybe_add_space(prefix + ":", sep) + args, sep=sep)
+def _error_prefix(prefix: str) -> str:
+    error_context = _ctx()
+    if error_context:
+        # The error context might contain escape sequences so we have to reset to red afterwards
+        return prefix + " " + error_context[-1] + AnsiColour.red.escape_sequence() + ":"
+    return prefix + ":"
 
 
 def error_message(*args, sep=" ", fixit_hint=None) -> None:
     # we ignore fatal errors when simulating a run
-    print(_add_error_context("Error", args, sep=sep), file=sys.stderr, flush=True)
+    _log(AnsiColour.red, _error_prefix("Error"), sep, args, sys.stderr, flush=True)
     if fixit_hint:
         fixit_message(fixit_hint)
 
@@ -239,14 +294,14 @@ def error_message(*args, sep=" ", fixit_hint=None) -> None:
 def fatal_error(*args, sep=" ", fixit_hint=None, fatal_when_pretending=False, exit_code=3, pretend: bool) -> None:
     # we ignore fatal errors when simulating a run
     if pretend:
-        print(_add_error_context("Potential fatal error", args, sep=sep), file=sys.stderr, flush=True)
+        _log(AnsiColour.red, _error_prefix("Potential fatal error"), sep, args, sys.stderr, flush=True)
         if fixit_hint:
             fixit_message(fixit_hint)
         if fatal_when_pretending:
             traceback.print_stack()
             sys.exit(exit_code)
     else:
-        print(_add_error_context("Fatal error", args, sep=sep), file=sys.stderr, flush=True)
+        _log(AnsiColour.red, _error_prefix("Fatal error"), sep, args, sys.stderr, flush=True)
         if fixit_hint:
             fixit_message(fixit_hint)
         sys.exit(exit_code)
@@ -262,6 +317,7 @@ def query_yes_no(
 ) -> bool:
     if yes_no_str is None:
         yes_no_str = " [Y]/n " if default_result else " y/[N] "
+    flush_log_messages()
     if config.pretend:
         print(message + yes_no_str, coloured(AnsiColour.green, "y" if force_result else "n"), sep="", flush=True)
         return force_result  # in pretend mode we always return true
@@ -272,61 +328,94 @@ def query_yes_no(
     if not sys.__stdin__.isatty():
         return default_result  # can't get any input -> return the default
     result = input(message + yes_no_str)
+    # Only look at the first character to avoid copying (potentially long) pasted input. An empty answer selects
+    # the default result since result[:1] will be the empty string.
     if default_result:
-        return not result.startswith("n")  # if default is yes accept anything other than strings starting with "n"
-    return str(result).lower().startswith("y")  # anything but y will be treated as false
+        return result[:1] not in ("n", "N")  # if default is yes accept anything other than strings starting with "n"
+    return result[:1] in ("y", "Y")  # anything but y will be treated as false
 
 
-@functools.lru_cache(maxsize=20)
+_RESOURCES_DIR = Path(__file__).parent
+
+
+# The set of files that can be included is small and fixed, so there is no need to bound the cache size.
+@functools.lru_cache(maxsize=None)
 def include_local_file(path: str) -> str:
-    file = Path(__file__).parent / path
+    file = _RESOURCES_DIR / path
     if not file.is_file():
         fatal_error(file, "is missing!", pretend=False)
-    with file.open("r", encoding="utf-8") as f:
-        return f.read()
+    return file.read_text(encoding="utf-8")
+
+
+# The result of the connectivity check is shared between all ConfigBase instances and threads.
+_internet_check_lock = threading.Lock()
+# (checked_at, result) of the last check. This is only ever replaced as a whole (while holding the lock) so that the
+# lock-free readers can never see the timestamp of one check combined with the result of another one.
+_internet_check_cache: "Optional[tuple[float, bool]]" = None
+
+
+def _cached_internet_check_result(config: ConfigBase, current_check_time: float) -> "Optional[bool]":
+    cache = _internet_check_cache
+    # Assume that the detected values remains the same for 60 seconds to avoid repeated checks.
+    # This saves around 50ms startup time.
+    if cache is not None and current_check_time < cache[0] + 60.0:
+        checked_at, result = cache
+        config.internet_connection_last_check_result = result
+        config.internet_connection_last_checked_at = checked_at
+        return result
+    return None
 
 
 def have_working_internet_connection(config: ConfigBase) -> bool:
+    global _internet_check_cache  # noqa: PLW0603
     if config.TEST_MODE or config.presume_connectivity:
         return True
-    current_check_time = time.time()
-    if config.internet_connection_last_checked_at:
-        if current_check_time < config.internet_connection_last_checked_at + 60.0:
-            # Assume that the detected values remains the same for 60 seconds to avoid repeated checks.
-            # This saves around 50ms startup time.
-            return config.internet_connection_last_check_result
-    # Try to connect to google DNS server at 8.8.8.8 to check if we have a working internet connection
-    # Don't make a DNS request since that could be broken for other reasons!
-    # From https://stackoverflow.com/questions/3764291/checking-network-connection/33117579#33117579
-    host = "8.8.8.8"
-    port = 53
-    timeout = 3
-    x = None
-    result = False
-    try:
-        x = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        x.settimeout(timeout)
-        x.connect((host, port))
-        result = True
-    except OSError:
-        result = False
-    except Exception as ex:
-        fatal_error("Something went wrong while checking for internet connection", ex, pretend=config.pretend)
-        result = False
-    finally:
-        if x:
-            x.close()
+    cached = _cached_internet_check_result(config, time.time())
+    if cached is not None:
+        return cached
+    with _internet_check_lock:
+        # Another thread might have performed the check while we were waiting for the lock.
+        current_check_time = time.time()
+        cached = _cached_internet_check_result(config, current_check_time)
+        if cached is not None:
+            return cached
+        # Try to connect to google DNS server at 8.8.8.8 to check if we have a working internet connection
+        # Don't make a DNS request since that could be broken for other reasons!
+        # From https://stackoverflow.com/questions/3764291/checking-network-connection/33117579#33117579
+        try:
+            with socket.create_connection(("8.8.8.8", 53), timeout=3):
+                result = True
+        except OSError:
+            result = False
+        except Exception as ex:
+            fatal_error("Something went wrong while checking for internet connection", ex, pretend=config.pretend)
+            result = False
+        _internet_check_cache = (current_check_time, result)
         config.internet_connection_last_check_result = result
         config.internet_connection_last_checked_at = current_check_time
         return result
 
 
+# Case sensitivity is a property of the file system, so we only need to check once per device.
+# Note: This ignores per-directory case folding (e.g. ext4 "chattr +F").
+_case_sensitive_by_device: "dict[int, bool]" = {}
+
+
 def is_case_sensitive_dir(d: Path) -> bool:
     if not d.exists():
         # assume true for macos:
         if OSInfo.IS_MAC:
             return False
         return True  # XXX: exception?
+    device = d.stat().st_dev
+    result = _case_sensitive_by_device.get(device)
+    if result is None:
+        result = _check_case_sensitive_dir(d)
+        _case_sensitive_by_device[device] = result
+    return result
+
+
+def _check_case_sensitive_dir(d: Path) -> bool:
     path_upper = d / "TestDirCaseSensitive"
     path_lower = d / "testdircasesensitive"
     if path_upper.exists():
@@ -342,6 +431,12 @@ def is_case_sensitive_dir(d: Path) -> bool:
     return True
 
 
+# Avoid walking $PATH every time install_instructions() looks for the same helper tool
+@functools.lru_cache(maxsize=None)
+def _which(program: str) -> "Optional[str]":
+    return shutil.which(program)
+
+
 class InstallInstructions:
     def __init__(
         self,
@@ -387,21 +482,30 @@ class OSInfo:
     IS_LINUX: bool = sys.platform.startswith("linux")
     IS_FREEBSD: bool = sys.platform.startswith("freebsd")
     IS_MAC: bool = sys.platform.startswith("darwin")
+    _OS_RELEASE_PATH = Path("/etc/os-release")
     __os_release_cache: "Optional[dict[str, str]]" = None
+    _DISTRO_ID: "frozenset[str]" = frozenset()
+    _DISTRO_ID_LIKE: "frozenset[str]" = frozenset()
+    # Note: The is_*() and uses_*() checks are cached since the result cannot change while running and they are
+    # called many times (e.g. from install_instructions()).
 
     @classmethod
+    @functools.lru_cache(maxsize=1)
     def is_ubuntu(cls) -> bool:
         return cls.__is_linux_distribution("ubuntu")
 
     @classmethod
+    @functools.lru_cache(maxsize=1)
     def is_suse(cls) -> bool:
         return cls.__is_linux_distribution("suse") or cls.__is_linux_distribution("opensuse")
 
     @classmethod
+    @functools.lru_cache(maxsize=1)
     def is_debian(cls) -> bool:
         return cls.__is_linux_distribution("debian")
 
     @classmethod
+    @functools.lru_cache(maxsize=1)
     def is_cheribsd(cls) -> bool:
         return cls.IS_FREEBSD and cls.etc_os_release().get("ID", "") == "cheribsd"
 
@@ -409,28 +513,32 @@ class OSInfo:
     def __is_linux_distribution(cls, kind):
         if not cls.IS_LINUX:
             return False
-        return kind in cls.etc_os_release().get("ID", "") or kind in cls.etc_os_release().get("ID_LIKE", "")
+        cls.etc_os_release()  # ensure _DISTRO_ID and _DISTRO_ID_LIKE have been initialized
+        return kind in cls._DISTRO_ID or kind in cls._DISTRO_ID_LIKE
 
     @staticmethod
     def etc_os_release() -> "dict[str, str]":
         if OSInfo.__os_release_cache is None:
-            OSInfo.__os_release_cache = OSInfo.__parse_etc_os_release()
+            os_release = OSInfo.__parse_etc_os_release()
+            OSInfo._DISTRO_ID = frozenset(os_release.get("ID", "").split())
+            OSInfo._DISTRO_ID_LIKE = frozenset(os_release.get("ID_LIKE", "").split())
+            OSInfo.__os_release_cache = os_release
         return OSInfo.__os_release_cache
 
     @staticmethod
     def __parse_etc_os_release() -> "dict[str, str]":
-        if not Path("/etc/os-release").exists():
+        path = OSInfo._OS_RELEASE_PATH
+        if not path.exists():
+            return {}
+        # /etc/os-release uses shell-compatible quoting, so let shlex handle quotes and escapes. Only lines starting
+        # with "#" are comments (shlex would also treat an unquoted "#" in the middle of a value as a comment).
+        lines = path.read_text(encoding="utf-8", errors="replace").splitlines()
+        try:
+            tokens = shlex.split("\n".join(line for line in lines if not line.lstrip().startswith("#")))
+        except ValueError as e:
+            warning_message("Could not parse", path, e)
             return {}
-        with Path("/etc/os-release").open(encoding="utf-8") as f:
-            d = {}
-            for line in f:
-                line = line.strip()
-                if not line or line[0] == "#":
-                    continue
-                k, v = line.split("=", maxsplit=1)
-                # .strip('"') will remove if there or else do nothing
-                d[k] = v.strip('"')
-        return d
+        return dict(token.split("=", maxsplit=1) for token in tokens if "=" in token)
 
     @classmethod
     def package_manager(cls, compat_abi=False) -> str:
@@ -476,10 +584,11 @@ class OSInfo:
             if zypper:
                 install_name = zypper
             else:
-                if not is_lib and shutil.which("command-not-found"):
+                cnf = None if is_lib else _which("command-not-found")
+                if cnf:
                     # for programs we can use the command-not-found tool to get detailed install instructions
                     def command_not_found():
-                        hint = subprocess.getoutput(shutil.which("command-not-found") + " " + name)
+                        hint = subprocess.getoutput(cnf + " " + name)
                         print(hint)
                         if hint and name + ": command not found" not in hint:
                             msg_start = hint.find("The program")
@@ -512,10 +621,12 @@ class OSInfo:
             )
 
     @classmethod
+    @functools.lru_cache(maxsize=1)
     def uses_apt(cls) -> bool:
         return cls.is_debian() or cls.is_ubuntu()
 
     @classmethod
+    @functools.lru_cache(maxsize=1)
     def uses_zypper(cls) -> bool:
         return cls.is_suse()
 
@@ -541,37 +652,64 @@ class ThreadJoiner:
             thread.join()
 
     def __add__(self, other: "ThreadJoiner") -> "ThreadJoiner":
-        return ThreadJoiner(self.threads + other.threads)
+        return ThreadJoiner([*self.threads, *other.threads])
 
     def __iadd__(self, other: "ThreadJoiner") -> "ThreadJoiner":
-        self.threads += other.threads
+        self.threads.extend(other.threads)
         return self
 
 
 def replace_one(s: str, old, new) -> str:
     """Like str.replace() but raises an exception if old is not in s"""
-    result = s.replace(old, new, 1)
-    if result == s:
+    idx = s.find(old)
+    if idx < 0:
         raise ValueError(old + " not contained in " + s)
+    return s[:idx] + new + s[idx + len(old) :]
+
+
+# For very short sequences (e.g. a handful of compiler flags) a linear scan is faster than building a dict.
+# Note: Unlike dict.fromkeys(), the linear scan also accepts unhashable items. Callers must not rely on this since
+# longer sequences of unhashable items will still raise a TypeError.
+_SMALL_SEQUENCE_LENGTH = 5
+
+
+def _remove_duplicates_small(items: "typing.Sequence[Type_T]") -> "list[Type_T]":
+    result: "list[Type_T]" = []
+    for item in items:
+        if item not in result:
+            result.append(item)
     return result
 
 
 def remove_duplicates(items: "typing.Iterable[Type_T]") -> "list[Type_T]":
+    if isinstance(items, (list, tuple)) and len(items) <= _SMALL_SEQUENCE_LENGTH:
+        return _remove_duplicates_small(items)
     # Convert to a dict to remove duplicates (retains order since python 3.6, which is older than our minimum)
     return list(dict.fromkeys(items))
 
 
 def remove_tuple_duplicates(items: "typing.Iterable[Type_T]") -> "tuple[Type_T, ...]":
+    if isinstance(items, (list, tuple)) and len(items) <= _SMALL_SEQUENCE_LENGTH:
+        return tuple(_remove_duplicates_small(items))
     # Convert to a dict to remove duplicates (retains order since python 3.6, which is older than our minimum)
     return tuple(dict.fromkeys(items))
 
 
-def remove_prefix(s: str, prefix: str, prefix_required=False) -> str:
-    if not s.startswith(prefix):
-        if prefix_required:
+if sys.version_info >= (3, 9):
+
+    def remove_prefix(s: str, prefix: str, prefix_required=False) -> str:
+        if prefix_required and not s.startswith(prefix):
             raise ValueError(s + " does not start with " + prefix)
-        return s
-    return s[len(prefix) :]
+        return s.removeprefix(prefix)
+
+else:
+
+    def remove_prefix(s: str, prefix: str, prefix_required=False) -> str:
+        if not s.startswith(prefix):
+            if prefix_required:
+                raise ValueError(s + " does not start with " + prefix)
+            return s
+        return s[len(prefix) :]
 
 
 # A dictionary for string formatting (format_map) that preserves values not
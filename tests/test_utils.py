@@ -0,0 +1,180 @@
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pycheribuild.utils
+from pycheribuild.colour import AnsiColour, coloured
+from pycheribuild.utils import (
+    ConfigBase,
+    OSInfo,
+    add_error_context,
+    error_message,
+    fixit_message,
+    have_working_internet_connection,
+    status_update,
+    warning_message,
+)
+
+_cheribuild_root = Path(__file__).parent.parent
+
+
+def _run_python(code: str) -> "list[str]":
+    # Run in a separate process with stdout and stderr redirected to the same pipe (i.e. fully buffered, as in a
+    # build log) to check that the relative ordering of the output is preserved.
+    result = subprocess.run(
+        [sys.executable, "-c", "from pycheribuild.utils import *\n" + code],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        cwd=str(_cheribuild_root),
+        check=True,
+    )
+    return [line for line in result.stdout.decode("utf-8").splitlines() if line]
+
+
+def test_log_output_ordering():
+    assert _run_python('status_update("first"); print("second"); warning_message("third"); print("fourth")') == [
+        coloured(AnsiColour.cyan, "first"),
+        "second",
+        coloured(AnsiColour.magenta, "Warning: third"),
+        "fourth",
+    ]
+    assert _run_python('import sys; status_update("a"); status_update("b", file=sys.stderr); print("c")') == [
+        coloured(AnsiColour.cyan, "a"),
+        coloured(AnsiColour.cyan, "b"),
+        "c",
+    ]
+
+
+def test_log_output_flushed_before_subprocess():
+    code = (
+        "from pycheribuild.processutils import popen_handle_noexec\n"
+        'status_update("before")\n'
+        'print("plain before")\n'
+        'popen_handle_noexec(["echo", "subprocess"]).wait()\n'
+        'status_update("after")\n'
+    )
+    assert _run_python(code) == [
+        coloured(AnsiColour.cyan, "before"),
+        "plain before",
+        "subprocess",
+        coloured(AnsiColour.cyan, "after"),
+    ]
+
+
+def test_status_update_single_list_argument(capsys):
+    status_update([Path("a"), "b", 1])
+    status_update(("x", "y"), sep=",")
+    status_update("list:", ["a", "b"])
+    assert capsys.readouterr().out.splitlines() == [
+        coloured(AnsiColour.cyan, "a b 1"),
+        coloured(AnsiColour.cyan, "x,y"),
+        coloured(AnsiColour.cyan, "list: ['a', 'b']"),
+    ]
+
+
+def test_coloured_prefix():
+    red = AnsiColour.red.escape_sequence()
+    assert coloured(AnsiColour.red, "a", "b", prefix="Error:") == red + "Error: a b\x1b[0m"
+    assert coloured(AnsiColour.red, "a", "b", sep=",", prefix="Error:") == red + "Error:,a,b\x1b[0m"
+    # The prefix is always separated from the message, even if sep is empty
+    assert coloured(AnsiColour.red, "a", "b", sep="", prefix="Error:") == red + "Error: ab\x1b[0m"
+    # A single list argument is only expanded without a prefix
+    assert coloured(AnsiColour.red, ["a", "b"]) == red + "a b\x1b[0m"
+    assert coloured(AnsiColour.red, ["a", "b"], prefix="Error:") == red + "Error: ['a', 'b']\x1b[0m"
+    assert coloured(AnsiColour.red, prefix="Error:") == red + "Error:\x1b[0m"
+
+
+def test_message_helpers_output(capsys):
+    warning_message("a", "b")
+    warning_message("a", "b", sep="")
+    warning_message(["a", "b"])
+    fixit_message("c", 1)
+    error_message("d")
+    with add_error_context("in context"):
+        error_message("e", "f")
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    red = AnsiColour.red.escape_sequence()
+    assert captured.err.splitlines() == [
+        AnsiColour.magenta.escape_sequence() + "Warning: a b\x1b[0m",
+        AnsiColour.magenta.escape_sequence() + "Warning: ab\x1b[0m",
+        AnsiColour.magenta.escape_sequence() + "Warning: ['a', 'b']\x1b[0m",
+        AnsiColour.blue.escape_sequence() + "Possible solution: c 1\x1b[0m",
+        red + "Error: d\x1b[0m",
+        red + "Error in context" + red + ": e f\x1b[0m",
+    ]
+
+
+def test_internet_connection_check_shared(monkeypatch):
+    probes = []
+
+    class FakeConnection:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+    def fake_create_connection(address, timeout):
+        probes.append(address)
+        time.sleep(0.1)  # make sure that the other threads are waiting for the result
+        return FakeConnection()
+
+    monkeypatch.setattr(pycheribuild.utils, "_internet_check_cache", None)
+    monkeypatch.setattr(pycheribuild.utils.socket, "create_connection", fake_create_connection)
+    configs = [ConfigBase(pretend=False, verbose=False, quiet=False, force=False) for _ in range(8)]
+    results = []
+    threads = [
+        threading.Thread(target=lambda c=c: results.append(have_working_internet_connection(c))) for c in configs
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # Only one thread should have performed the check and all others must see the result of that check.
+    assert len(probes) == 1
+    assert results == [True] * len(configs)
+    assert all(c.internet_connection_last_check_result for c in configs)
+
+
+def _parse_os_release(monkeypatch, tmp_path: Path, contents: str) -> "dict[str, str]":
+    os_release = tmp_path / "os-release"
+    os_release.write_text(contents, encoding="utf-8")
+    monkeypatch.setattr(OSInfo, "_OS_RELEASE_PATH", os_release)
+    monkeypatch.setattr(OSInfo, "_OSInfo__os_release_cache", None)
+    monkeypatch.setattr(OSInfo, "_DISTRO_ID", frozenset())
+    monkeypatch.setattr(OSInfo, "_DISTRO_ID_LIKE", frozenset())
+    return OSInfo.etc_os_release()
+
+
+def test_parse_etc_os_release(monkeypatch, tmp_path):
+    contents = """# A comment line
+NAME="openSUSE Tumbleweed"
+  # An indented comment
+ID=opensuse-tumbleweed
+ID_LIKE='opensuse suse'
+PRETTY_NAME='Single "quoted" name'
+VARIANT=
+BUG_REPORT_URL="https://bugs.opensuse.org"
+HASH=a#b
+"""
+    assert _parse_os_release(monkeypatch, tmp_path, contents) == {
+        "NAME": "openSUSE Tumbleweed",
+        "ID": "opensuse-tumbleweed",
+        "ID_LIKE": "opensuse suse",
+        "PRETTY_NAME": 'Single "quoted" name',
+        "VARIANT": "",
+        "BUG_REPORT_URL": "https://bugs.opensuse.org",
+        "HASH": "a#b",
+    }
+    assert OSInfo._DISTRO_ID == frozenset({"opensuse-tumbleweed"})
+    assert OSInfo._DISTRO_ID_LIKE == frozenset({"opensuse", "suse"})
+
+
+def test_parse_invalid_etc_os_release(monkeypatch, tmp_path, capsys):
+    assert _parse_os_release(monkeypatch, tmp_path, 'ID=debian\nNAME="unterminated\n') == {}
+    assert "Could not parse" in capsys.readouterr().err
+    assert OSInfo._DISTRO_ID == frozenset()
+    assert OSInfo._DISTRO_ID_LIKE == frozenset()